@@ -1,19 +1,38 @@
+import asyncio
+import hashlib
 import os
+import types
+import queue
 import re
+import threading
 import time
 from dataclasses import dataclass, field
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 
 import streamlit as st
-import yaml
+from yaml import load as _yaml_load
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
+
+try:  # LibYAML-backed loader when PyYAML was built with it
+    from yaml import CSafeLoader as _SafeLoader
+except ImportError:
+    from yaml import SafeLoader as _SafeLoader
+
+try:  # fast non-cryptographic hash for lesson cache fingerprints
+    import xxhash
+
+    def _fingerprint(raw: bytes) -> bytes:
+        return xxhash.xxh3_64_digest(raw)
+except ImportError:
+    def _fingerprint(raw: bytes) -> bytes:
+        return hashlib.blake2b(raw, digest_size=8).digest()
 
 # LangGraph (minimal usage to orchestrate lesson state & tools)
 from langgraph.graph import StateGraph, START, END
 
 # Local tool for slide export
-from tools.slide_export import export_dmaic_to_pptx
+from tools.slide_export import export_dmaic_to_pptx_bytes
 
 # ----------------------
 # Environment & Clients
@@ -22,7 +41,15 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     st.warning("OPENAI_API_KEY not found in environment. Set it in a .env file.")
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Debug aid: also write generated decks to ./exports (downloads are served from memory)
+SAVE_EXPORTS = os.getenv("SAVE_EXPORTS", "").lower() in ("1", "true", "yes")
+
+# One event loop thread per process drives all OpenAI I/O; the script thread only drains tokens
+@st.cache_resource(show_spinner=False)
+def _openai_runtime() -> Tuple[asyncio.AbstractEventLoop, AsyncOpenAI]:
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="openai-io", daemon=True).start()
+    return loop, AsyncOpenAI(api_key=OPENAI_API_KEY)
 
 # ----------------------
 # UI Config
@@ -40,40 +67,89 @@ SYSTEM_PROMPT_BASE = (
     "activate step-by-step tutoring. Avoid performing all steps at once; coach the user "
     "through each step with feedback and encouragement."
 )
+BANNED_RE = re.compile(r"build a bomb|self[\s-]?harm|suicide|harm others", re.IGNORECASE)
+LESSON_TRIGGER_RE = re.compile(r"teach me|learn|study", re.IGNORECASE)
+STREAM_FLUSH_MS = 33       # repaint streamed replies at most ~30x per second...
+STREAM_FLUSH_CHARS = 256   # ...or sooner once this much unrendered text piles up
+HISTORY_WINDOW = 30        # newest messages drawn as chat bubbles; older ones fold into one transcript
+MAX_TURNS = 20             # once history passes 2*MAX_TURNS messages, older ones are summarized...
+KEEP_TURNS = 10            # ...keeping only the last 2*KEEP_TURNS messages verbatim
+SUMMARY_TIMEOUT_S = 30     # give up on a summary (and keep the full history) after this long
+SUMMARY_PROMPT = (
+    "Summarize the conversation below for your own future reference. Keep the user's goals, "
+    "facts and decisions, open questions, and any lesson progress. Be concise; use short bullet points."
+)
 
 def ensure_session_defaults():
     if "model_name" not in st.session_state:
         st.session_state.model_name = DEFAULT_MODEL
     if "app_state" not in st.session_state:
-        st.session_state.app_state = AppState(lessons_bank=load_lessons())
+        app_state = AppState()
+        set_lessons_bank(app_state, load_lessons())
+        st.session_state.app_state = app_state
 
 def get_current_model() -> str:
     return st.session_state.get("model_name", DEFAULT_MODEL)
 
-def load_lessons() -> Dict[str, Dict[str, Any]]:
+@st.cache_resource(show_spinner=False)
+def _lesson_parse_cache() -> Dict[str, Tuple[bytes, Dict[str, Any]]]:
+    # path -> (content fingerprint, parsed YAML); shared across reruns and sessions
+    return {}
+
+def _lesson_files() -> Tuple[Tuple[str, str, bytes], ...]:
+    # Keyed on content, not stat: mtime/size can't be trusted to change on edits (image layers,
+    # synced volumes), and hashing a few small YAML files is far cheaper than parsing them.
+    files = []
+    try:
+        with os.scandir(LESSONS_DIR) as it:
+            for entry in it:
+                if not entry.name.lower().endswith(('.yaml', '.yml')) or not entry.is_file():
+                    continue
+                try:
+                    with open(entry.path, 'rb') as f:
+                        digest = _fingerprint(f.read())
+                except OSError as e:
+                    print(f"Failed to load {entry.name}: {e}")
+                    continue
+                files.append((entry.name, entry.path, digest))
+    except (FileNotFoundError, NotADirectoryError):
+        return ()
+    return tuple(sorted(files))
+
+@st.cache_resource(show_spinner=False, max_entries=1)  # only the latest directory snapshot is ever requested
+def _load_lessons_cached(files: Tuple[Tuple[str, str, bytes], ...]) -> Dict[str, Dict[str, Any]]:
+    parsed = _lesson_parse_cache()
     lessons = {}
-    if not os.path.isdir(LESSONS_DIR):
-        return lessons
-    for fname in os.listdir(LESSONS_DIR):
-        if not fname.lower().endswith(('.yaml', '.yml')):
-            continue
-        path = os.path.join(LESSONS_DIR, fname)
-        try:
-            with open(path, 'r', encoding='utf-8') as f:
-                data = yaml.safe_load(f)
-                if isinstance(data, dict) and 'id' in data:
-                    lessons[data['id']] = data
-        except Exception as e:
-            print(f"Failed to load {fname}: {e}")
+    for fname, path, digest in files:
+        cached = parsed.get(path)
+        if cached is not None and cached[0] == digest:
+            data = cached[1]
+        else:
+            try:
+                with open(path, 'rb') as f:
+                    data = _yaml_load(f.read(), Loader=_SafeLoader)
+            except Exception as e:
+                print(f"Failed to load {fname}: {e}")
+                continue
+            parsed[path] = (digest, data)
+        if isinstance(data, dict) and 'id' in data:
+            lessons[data['id']] = data
     return lessons
 
-def nlu_detect_lesson_request(text: str, lesson_titles: List[str]) -> Optional[str]:
+def load_lessons() -> Dict[str, Dict[str, Any]]:
+    # One read + hash per file per call; YAML is re-parsed only for files whose content changed.
+    return _load_lessons_cached(_lesson_files())
+
+def build_lesson_title_map(lessons_bank: Dict[str, Dict[str, Any]]) -> List[Tuple[str, str]]:
+    return [(meta.get("title", lid).lower(), lid) for lid, meta in lessons_bank.items()]
+
+def nlu_detect_lesson_request(text: str, title_map: List[Tuple[str, str]]) -> Optional[str]:
+    if not LESSON_TRIGGER_RE.search(text):
+        return None
     lowered = text.lower()
-    triggers = ["teach me", "learn", "study"]
-    if any(t in lowered for t in triggers):
-        for lt in lesson_titles:
-            if lt.lower() in lowered:
-                return lt
+    for title, lid in title_map:
+        if title in lowered:
+            return lid
     return None
 
 # ----------------------
@@ -98,60 +174,284 @@ class AppState:
     lesson_state: LessonState = field(default_factory=LessonState)
     lessons_bank: Dict[str, Dict[str, Any]] = field(default_factory=dict)
     requested_tool: Optional[str] = None  # e.g., "export_dmaic"
+    lesson_title_map: List[Tuple[str, str]] = field(default_factory=list)  # (lowercased title, lesson id)
+    lessons_bank_sorted: List[Tuple[str, Dict[str, Any]]] = field(default_factory=list)  # sidebar order
+    history_summary: str = ""  # rolling summary of messages trimmed from the head of the history
+    summary_retry_at: int = 0  # after a failed summary, don't retry until the history reaches this length
+
+def set_lessons_bank(app_state: AppState, lessons_bank: Dict[str, Dict[str, Any]]) -> None:
+    app_state.lessons_bank = lessons_bank
+    app_state.lesson_title_map = build_lesson_title_map(lessons_bank)
+    app_state.lessons_bank_sorted = sorted(lessons_bank.items(), key=lambda x: x[1].get("title", x[0]))
+
+@st.cache_resource(show_spinner=False)
+def _system_prompt_cache() -> Dict[str, Tuple[Dict[str, Dict[str, Any]], str]]:
+    # lesson_id -> (lessons_bank it was built from, prompt); shared across reruns and sessions.
+    # The outline covers every step, so it only changes when the (shared, cached) lessons bank is reloaded.
+    return {}
+
+def _build_lesson_system_prompt(lesson_id: str, lesson: Dict[str, Any]) -> str:
+    title = lesson.get("title", lesson_id)
+    study_modifier = (
+        f"Study & Learn mode is ACTIVE for lesson '{title}'. "
+        f"Teach strictly step-by-step using the YAML steps below. "
+        f"For each step: 1) ask user for their attempt/input, "
+        f"2) provide targeted feedback and suggest one improvement, "
+        f"3) if the user does not improve after that suggestion, proceed to the next step. "
+        f"Do NOT reveal future steps early. When the final step completes, stop and await tool execution."
+    )
+    lesson_summary = []
+    for i, step in enumerate(lesson.get("steps", []), start=1):
+        step_name = step.get("name", f"Step {i}")
+        goals = ", ".join(step.get("goals", [])[:3])
+        lesson_summary.append(f"{i}. {step_name} — goals: {goals}")
+    lesson_outline = "\n".join(lesson_summary)
+
+    return (
+        SYSTEM_PROMPT_BASE + "\n\n" +
+        study_modifier + "\n\n" +
+        f"Lesson outline (do not reveal more than current step):\n{lesson_outline}"
+    )
 
 def get_system_prompt(app_state: AppState) -> str:
-    if app_state.lesson_state.active and app_state.lesson_state.lesson_id:
-        lesson = app_state.lessons_bank.get(app_state.lesson_state.lesson_id, {})
-        title = lesson.get("title", app_state.lesson_state.lesson_id)
-        study_modifier = (
-            f"Study & Learn mode is ACTIVE for lesson '{title}'. "
-            f"Teach strictly step-by-step using the YAML steps below. "
-            f"For each step: 1) ask user for their attempt/input, "
-            f"2) provide targeted feedback and suggest one improvement, "
-            f"3) if the user does not improve after that suggestion, proceed to the next step. "
-            f"Do NOT reveal future steps early. When the final step completes, stop and await tool execution."
-        )
-        lesson_summary = []
-        for i, step in enumerate(lesson.get("steps", []), start=1):
-            step_name = step.get("name", f"Step {i}")
-            goals = ", ".join(step.get("goals", [])[:3])
-            lesson_summary.append(f"{i}. {step_name} — goals: {goals}")
-        lesson_outline = "\n".join(lesson_summary)
-
-        return (
-            SYSTEM_PROMPT_BASE + "\n\n" +
-            study_modifier + "\n\n" +
-            f"Lesson outline (do not reveal more than current step):\n{lesson_outline}"
-        )
-    return SYSTEM_PROMPT_BASE
+    lesson_id = app_state.lesson_state.lesson_id
+    if app_state.lesson_state.active and lesson_id:
+        bank = app_state.lessons_bank
+        prompts = _system_prompt_cache()
+        cached = prompts.get(lesson_id)
+        if cached is not None and cached[0] is bank:
+            prompt = cached[1]
+        else:
+            prompt = _build_lesson_system_prompt(lesson_id, bank.get(lesson_id, {}))
+            prompts[lesson_id] = (bank, prompt)
+    else:
+        prompt = SYSTEM_PROMPT_BASE
+    if app_state.history_summary:
+        prompt += f"\n\nSummary of the earlier conversation:\n{app_state.history_summary}"
+    return prompt
+
+@st.cache_resource(show_spinner=False)
+def _coach_preamble_cache() -> Dict[Tuple[str, int], Tuple[Dict[str, Dict[str, Any]], str]]:
+    # (lesson_id, step_idx) -> (lessons_bank it was built from, preamble); same invalidation as above
+    return {}
+
+def _build_coach_preamble(step: Dict[str, Any], step_idx: int) -> str:
+    step_name = step.get("name", f"Step {step_idx+1}")
+    goals = step.get("goals", [])
+    best_practices = step.get("best_practices", [])
+    prompts_for_user = step.get("prompts_for_user", [])
+    return (
+        f"You are coaching the user through step '{step_name}'.\n"
+        f"Goals: {goals}\n"
+        f"Best Practices: {best_practices}\n"
+        f"Prompts to ask the user: {prompts_for_user}\n"
+        f"If the user provided an attempt, give precise feedback and ONE suggested improvement.\n"
+        f"If you already suggested an improvement and they didn't improve, proceed to the next step.\n"
+        f"Keep messages concise and focused on this step only."
+    )
+
+def get_coach_preamble(app_state: AppState, step: Dict[str, Any]) -> str:
+    key = (app_state.lesson_state.lesson_id, app_state.lesson_state.current_step_idx)
+    bank = app_state.lessons_bank
+    preambles = _coach_preamble_cache()
+    cached = preambles.get(key)
+    if cached is not None and cached[0] is bank:
+        return cached[1]
+    preamble = _build_coach_preamble(step, key[1])
+    preambles[key] = (bank, preamble)
+    return preamble
 
 # ------------- LLM wrappers -------------
-def model_stream_response(system_prompt: str, messages: List[Dict[str, str]], model: str):
-    stream = client.chat.completions.create(
+async def amodel_stream_response(
+    aclient: AsyncOpenAI,
+    system_prompt: str,
+    messages: List[Dict[str, str]],
+    model: str,
+    suffix: Optional[Dict[str, str]] = None,
+):
+    # Request list is built once here; `suffix` is appended without copying the history first
+    request = [{"role": "system", "content": system_prompt}, *messages]
+    if suffix is not None:
+        request.append(suffix)
+    stream = await aclient.chat.completions.create(model=model, stream=True, messages=request)
+    async for chunk in stream:
+        choices = chunk.choices
+        if not choices:
+            continue
+        content = choices[0].delta.content
+        if content:
+            yield content
+
+async def _pump_stream(
+    tokens: "queue.Queue[Optional[str]]",
+    aclient: AsyncOpenAI,
+    system_prompt: str,
+    messages: List[Dict[str, str]],
+    model: str,
+    suffix: Optional[Dict[str, str]],
+) -> None:
+    try:
+        async for token in amodel_stream_response(aclient, system_prompt, messages, model, suffix):
+            tokens.put(token)
+    finally:
+        tokens.put(None)
+
+# Sync bridge for the graph nodes: the request runs on the shared event loop and
+# tokens are handed back through a queue so Streamlit calls stay on the script thread.
+def model_stream_response(
+    system_prompt: str,
+    messages: List[Dict[str, str]],
+    model: str,
+    suffix: Optional[Dict[str, str]] = None,
+):
+    loop, aclient = _openai_runtime()
+    tokens: "queue.Queue[Optional[str]]" = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(
+        _pump_stream(tokens, aclient, system_prompt, messages, model, suffix), loop
+    )
+    try:
+        while True:
+            token = tokens.get()
+            if token is None:
+                break
+            yield token
+        future.result()  # surface API errors raised inside the loop
+    finally:
+        future.cancel()
+
+async def amodel_complete(aclient: AsyncOpenAI, system_prompt: str, messages: List[Dict[str, str]], model: str) -> str:
+    resp = await aclient.chat.completions.create(
         model=model,
-        stream=True,
         messages=[{"role": "system", "content": system_prompt}] + messages
     )
-    for chunk in stream:
-        if hasattr(chunk, "choices") and chunk.choices:
-            delta = chunk.choices[0].delta
-            if delta and delta.content:
-                yield delta.content
+    return resp.choices[0].message.content or ""
+
+def model_complete(
+    system_prompt: str,
+    messages: List[Dict[str, str]],
+    model: str,
+    timeout: Optional[float] = None,
+) -> str:
+    loop, aclient = _openai_runtime()
+    future = asyncio.run_coroutine_threadsafe(
+        amodel_complete(aclient, system_prompt, messages, model), loop
+    )
+    try:
+        return future.result(timeout=timeout)
+    finally:
+        future.cancel()  # no-op once finished; stops the request on timeout
+
+FENCE_RE = re.compile(r" {0,3}(`{3,}|~{3,})(.*)")
+
+# Fence marker still open after the lines in `text` (None if outside a code block)
+def _track_fence(fence: Optional[str], text: str) -> Optional[str]:
+    for line in text.split("\n"):
+        m = FENCE_RE.match(line)
+        if not m:
+            continue
+        marker, info = m.groups()
+        if fence is None:
+            if not (marker[0] == "`" and "`" in info):  # a backtick info string means inline code, not a fence
+                fence = marker
+        elif marker[0] == fence[0] and len(marker) >= len(fence) and not info.strip():
+            fence = None
+    return fence
+
+# Render streamed tokens into the current container, coalescing repaints into frames.
+# Finished paragraphs are frozen in their own element so each repaint only resends the tail.
+# A blank line only ends a paragraph outside code fences and when the next line is not indented
+# (list continuations / indented code must stay in the same element to render the same as history).
+def render_stream(tokens: Iterable[str]) -> str:
+    placeholder = st.empty()
+    paragraphs: List[str] = []
+    tail = ""
+    fence: Optional[str] = None  # open fence as of tail[:scanned]
+    scanned = 0  # line start up to which fences have been tracked
+    rendered_len = 0
+    last_flush = time.monotonic()
+    first = True
+    for token in tokens:
+        if first and token:
+            # paint the first delta synchronously so time-to-first-token is unaffected by batching
+            first = False
+            tail = token
+            placeholder.markdown(tail)
+            rendered_len = len(tail)
+            last_flush = time.monotonic()
+            continue
+        tail += token
+        # visit each blank line once, as soon as the first character after it is known
+        idx = tail.find("\n\n", max(scanned, len(tail) - len(token) - 2))
+        while 0 <= idx < len(tail) - 2:
+            fence = _track_fence(fence, tail[scanned:idx])
+            scanned = idx + 2
+            if fence is None and tail[:idx].strip() and tail[scanned] not in " \t\n":
+                placeholder.markdown(tail[:idx])
+                paragraphs.append(tail[:idx])
+                placeholder = st.empty()
+                tail = tail[scanned:]
+                scanned = 0
+                rendered_len = 0
+            idx = tail.find("\n\n", scanned)
+        now = time.monotonic()
+        if (now - last_flush) * 1000 >= STREAM_FLUSH_MS or len(tail) - rendered_len > STREAM_FLUSH_CHARS:
+            placeholder.markdown(tail)
+            rendered_len = len(tail)
+            last_flush = now
+    if rendered_len != len(tail):
+        placeholder.markdown(tail)
+    paragraphs.append(tail)
+    return "\n\n".join(paragraphs)
+
+# Markdown transcript of chat messages, used for the folded history on the page
+def format_transcript(messages: List[Dict[str, str]]) -> str:
+    return "\n\n---\n\n".join(f"**{m['role'].title()}:** {m['content']}" for m in messages)
+
+# Keep the history (and so prompt size, reruns and state copies) bounded: fold everything but the
+# last KEEP_TURNS turns into app_state.history_summary once it passes MAX_TURNS turns.
+# Trimmed messages leave the prompt window but move to st.session_state.history_archive, which
+# render_history shows, so the scrollback on the page is kept.
+# Runs after the reply has been streamed; on failure the untrimmed history is kept and the next
+# attempt waits for another KEEP_TURNS turns, so a slow model doesn't stall every turn.
+def compact_history(app_state: AppState) -> None:
+    if len(app_state.messages) <= 2 * MAX_TURNS or len(app_state.messages) < app_state.summary_retry_at:
+        return
+    head = app_state.messages[:-2 * KEEP_TURNS]
+    transcript = "\n\n".join(f"{m['role']}: {m['content']}" for m in head)
+    if app_state.history_summary:
+        transcript = f"Summary so far:\n{app_state.history_summary}\n\nNewer messages:\n{transcript}"
+    try:
+        with st.spinner("Condensing earlier conversation…"):
+            summary = model_complete(
+                SUMMARY_PROMPT,
+                [{"role": "user", "content": transcript}],
+                model=get_current_model(),
+                timeout=SUMMARY_TIMEOUT_S,
+            )
+    except Exception as e:
+        print(f"Failed to summarize history: {e}")
+        app_state.summary_retry_at = len(app_state.messages) + 2 * KEEP_TURNS
+        return
+    app_state.history_summary = summary
+    app_state.summary_retry_at = 0
+    archived, archive = st.session_state.get("history_archive", (0, ""))
+    trimmed = format_transcript(head)
+    st.session_state.history_archive = (
+        archived + len(head),
+        f"{archive}\n\n---\n\n{trimmed}" if archive else trimmed,
+    )
+    del app_state.messages[:-2 * KEEP_TURNS]
 
 # ------------- Graph Nodes -------------
 def router_node(app_state: AppState) -> AppState:
     if not app_state.lessons_bank:
-        app_state.lessons_bank = load_lessons()
+        set_lessons_bank(app_state, load_lessons())
 
     if app_state.messages and app_state.messages[-1]["role"] == "user":
         user_text = app_state.messages[-1]["content"]
-        titles = [v.get("title", k) for k, v in app_state.lessons_bank.items()]
-        hit = nlu_detect_lesson_request(user_text, titles)
-        if hit:
-            for lid, meta in app_state.lessons_bank.items():
-                if meta.get("title", lid).lower() == hit.lower():
-                    app_state.lesson_state = LessonState(active=True, lesson_id=lid, current_step_idx=0)
-                    break
+        lid = nlu_detect_lesson_request(user_text, app_state.lesson_title_map)
+        if lid:
+            app_state.lesson_state = LessonState(active=True, lesson_id=lid, current_step_idx=0)
     return app_state
 
 def lesson_node(app_state: AppState) -> AppState:
@@ -165,34 +465,16 @@ def lesson_node(app_state: AppState) -> AppState:
         ls.completed = True
         return app_state
 
-    current_step = steps[ls.current_step_idx]
-    step_name = current_step.get("name", f"Step {ls.current_step_idx+1}")
-    goals = current_step.get("goals", [])
-    best_practices = current_step.get("best_practices", [])
-    prompts_for_user = current_step.get("prompts_for_user", [])
-
-    system_prompt = get_system_prompt(app_state)
-    coach_preamble = (
-        f"You are coaching the user through step '{step_name}'.\n"
-        f"Goals: {goals}\n"
-        f"Best Practices: {best_practices}\n"
-        f"Prompts to ask the user: {prompts_for_user}\n"
-        f"If the user provided an attempt, give precise feedback and ONE suggested improvement.\n"
-        f"If you already suggested an improvement and they didn't improve, proceed to the next step.\n"
-        f"Keep messages concise and focused on this step only."
-    )
-
     if app_state.messages and app_state.messages[-1]["role"] == "user":
+        system_prompt = get_system_prompt(app_state)
+        coach_preamble = get_coach_preamble(app_state, steps[ls.current_step_idx])
         with st.chat_message("assistant"):
-            placeholder = st.empty()
-            accum = ""
-            for token in model_stream_response(
+            accum = render_stream(model_stream_response(
                 system_prompt,
-                app_state.messages + [{"role": "assistant", "content": coach_preamble}],
-                model=get_current_model()
-            ):
-                accum += token
-                placeholder.markdown(accum)
+                app_state.messages,
+                model=get_current_model(),
+                suffix={"role": "assistant", "content": coach_preamble},
+            ))
         if accum.strip():
             app_state.messages.append({"role": "assistant", "content": accum})
 
@@ -219,11 +501,7 @@ def normal_chat_node(app_state: AppState) -> AppState:
     system_prompt = get_system_prompt(app_state)
     if app_state.messages and app_state.messages[-1]["role"] == "user":
         with st.chat_message("assistant"):
-            placeholder = st.empty()
-            accum = ""
-            for token in model_stream_response(system_prompt, app_state.messages, model=get_current_model()):
-                accum += token
-                placeholder.markdown(accum)
+            accum = render_stream(model_stream_response(system_prompt, app_state.messages, model=get_current_model()))
         if accum.strip():
             app_state.messages.append({"role": "assistant", "content": accum})
     return app_state
@@ -248,15 +526,19 @@ def completion_node(app_state: AppState) -> AppState:
                     "goals": step.get("goals", []),
                     "best_practices": step.get("best_practices", []),
                 })
-            out_path = export_dmaic_to_pptx(filled)
+            data = export_dmaic_to_pptx_bytes(filled)
+            file_name = f"dmaic_summary_{time.strftime('%Y%m%d_%H%M%S')}.pptx"
+            if SAVE_EXPORTS:
+                os.makedirs("exports", exist_ok=True)
+                with open(os.path.join("exports", file_name), "wb") as f:
+                    f.write(data)
             st.success("Slides ready.")
-            with open(out_path, "rb") as f:
-                st.download_button(
-                    "Download DMAIC Slides (.pptx)",
-                    data=f,
-                    file_name=os.path.basename(out_path),
-                    mime="application/vnd.openxmlformats-officedocument.presentationml.presentation",
-                )
+            st.download_button(
+                "Download DMAIC Slides (.pptx)",
+                data=data,
+                file_name=file_name,
+                mime="application/vnd.openxmlformats-officedocument.presentationml.presentation",
+            )
             app_state.messages.append({"role": "assistant", "content": "✔️ DMAIC lesson complete. Slides generated and ready to download."})
         else:
             st.markdown("Lesson complete. No post-lesson artifact for this lesson.")
@@ -265,15 +547,6 @@ def completion_node(app_state: AppState) -> AppState:
     app_state.lesson_state = LessonState(active=False, lesson_id=None, current_step_idx=0, completed=False)
     return app_state
 
-# Build the graph
-graph = StateGraph(AppState)
-graph.add_node("router", router_node)
-graph.add_node("lesson", lesson_node)
-graph.add_node("normal_chat", normal_chat_node)
-graph.add_node("completion", completion_node)
-
-graph.add_edge(START, "router")
-
 def should_go_lesson(state: AppState) -> str:
     if state.lesson_state.active and not state.lesson_state.completed:
         return "lesson"
@@ -282,22 +555,56 @@ def should_go_lesson(state: AppState) -> str:
     else:
         return "normal_chat"
 
-graph.add_conditional_edges("router", should_go_lesson, {
-    "lesson": "lesson",
-    "normal_chat": "normal_chat",
-    "completion": "completion",
-})
-
 def after_lesson(state: AppState) -> str:
     if state.lesson_state.completed:
         return "completion"
     return END
 
-graph.add_conditional_edges("lesson", after_lesson, {"completion": "completion", END: END})
-graph.add_edge("normal_chat", END)
-graph.add_edge("completion", END)
+GRAPH_FUNCS = (router_node, lesson_node, normal_chat_node, completion_node, should_go_lesson, after_lesson)
 
-compiled = graph.compile()
+def _hash_code(digest: Any, code: types.CodeType) -> None:
+    # bytecode, names and constants only: stable across reruns, unlike marshal (refcount-dependent)
+    digest.update(code.co_code)
+    digest.update(repr((code.co_names, code.co_varnames)).encode())
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _hash_code(digest, const)
+        else:
+            digest.update(repr(const).encode())
+
+# Changes whenever a node/edge function's code changes, so edits rebuild the cached graph
+def _graph_code_key() -> str:
+    digest = hashlib.blake2b(digest_size=8)
+    for fn in GRAPH_FUNCS:
+        _hash_code(digest, fn.__code__)
+    return digest.hexdigest()
+
+# Build the graph once per process (per node-code version); Streamlit reruns reuse the compiled graph
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _build_graph(code_key: str) -> Any:
+    graph = StateGraph(AppState)
+    graph.add_node("router", router_node)
+    graph.add_node("lesson", lesson_node)
+    graph.add_node("normal_chat", normal_chat_node)
+    graph.add_node("completion", completion_node)
+
+    graph.add_edge(START, "router")
+    graph.add_conditional_edges("router", should_go_lesson, {
+        "lesson": "lesson",
+        "normal_chat": "normal_chat",
+        "completion": "completion",
+    })
+    graph.add_conditional_edges("lesson", after_lesson, {"completion": "completion", END: END})
+    graph.add_edge("normal_chat", END)
+    graph.add_edge("completion", END)
+    return graph.compile()
+
+# NOTE: the compiled graph holds the node functions -- and through them the module globals -- of
+# the script run that built it. Helpers the nodes call (get_system_prompt, model_stream_response,
+# ...) and any module-level state resolve against that first run's namespace, not the current
+# one. Keep cross-rerun state behind st.cache_resource accessors, and restart the server after
+# editing node helpers; only edits to GRAPH_FUNCS themselves change the key and rebuild the graph.
+compiled = _build_graph(_graph_code_key())
 
 # ----------------------
 # Streamlit UI
@@ -335,7 +642,7 @@ with st.sidebar:
     if not app_state.lessons_bank:
         st.caption("No YAML lessons found in ./lessons")
     else:
-        for lid, meta in sorted(app_state.lessons_bank.items(), key=lambda x: x[1].get("title", x[0])):
+        for lid, meta in app_state.lessons_bank_sorted:
             title = meta.get("title", lid)
             if st.button(f"Start: {title}", key=f"start_{lid}"):
                 app_state.lesson_state = LessonState(active=True, lesson_id=lid, current_step_idx=0)
@@ -351,10 +658,32 @@ with st.sidebar:
 # Header
 st.markdown("## 🎓 Study & Learn Chat (LangGraph)")
 
-# Render history
-for msg in app_state.messages:
-    with st.chat_message(msg["role"]):
-        st.markdown(msg["content"])
+# Render history. Streamlit redraws everything on each rerun, so older messages are folded
+# into one markdown transcript that is only extended (never rebuilt) as the chat grows.
+# Messages already trimmed from app_state.messages by compact_history come first.
+def render_history(messages: List[Dict[str, str]]):
+    folded = max(len(messages) - HISTORY_WINDOW, 0)
+    archived, archive = st.session_state.get("history_archive", (0, ""))
+    transcript = ""
+    if folded:
+        first, count, transcript = st.session_state.get("history_transcript", (None, 0, ""))
+        if first is not messages[0] or count > folded:  # history was trimmed or replaced
+            count, transcript = 0, ""
+        if count < folded:
+            new = format_transcript(messages[count:folded])
+            transcript = f"{transcript}\n\n---\n\n{new}" if transcript else new
+            st.session_state.history_transcript = (messages[0], folded, transcript)
+    if archived or folded:
+        with st.expander(f"Earlier messages ({archived + folded})"):
+            if archive:
+                st.markdown(archive + ("\n\n---" if transcript else ""))
+            if transcript:
+                st.markdown(transcript)
+    for msg in messages[folded:]:
+        with st.chat_message(msg["role"]):
+            st.markdown(msg["content"])
+
+render_history(app_state.messages)
 
 # Input
 user_input = st.chat_input("Ask anything, or say 'Teach me about DMAIC/5S/5 Whys' to start a lesson…")
@@ -362,69 +691,44 @@ if user_input:
     with st.chat_message("user"):
         st.markdown(user_input)
 
-    banned = ["build a bomb", "self harm", "suicide", "harm others"]
-    if any(term in user_input.lower() for term in banned):
+    if BANNED_RE.search(user_input):
         with st.chat_message("assistant"):
             st.markdown("I can’t help with that. If you’re in immediate danger, please contact local emergency services.")
     else:
         app_state.messages.append({"role": "user", "content": user_input})
         result = compiled.invoke(app_state)
-        try:
-            app_state = AppState(**result)
-        except TypeError:
-            app_state = AppState(**dict(result))
+        # Nodes work on the session's own lists/dicts; rebind the returned fields instead of rebuilding AppState
+        if not isinstance(result, dict):
+            result = vars(result)
+        for name, value in result.items():
+            setattr(app_state, name, value)
+        compact_history(app_state)
         st.session_state.app_state = app_state
 
 # --- Fixed badge under the input bar (high z-index + bigger bottom offset) ---
+# Static stylesheet, minified: .study-badge is the fixed overlay (bottom offset clears the input
+# on most setups, a bit higher on small screens); .study-badge-inline is the in-flow fallback
+# for themes/browsers that block the overlay.
+STUDY_BADGE_CSS = (
+    "<style>"
+    ".study-badge{position:fixed;left:16px;bottom:120px;z-index:9999999;background:#f0faf6;"
+    "color:#0a7f5a;border:1px solid #10a37f55;border-radius:999px;padding:3px 8px;font-size:12px;"
+    "font-weight:500;box-shadow:0 1px 3px rgba(0,0,0,0.08);pointer-events:none}"
+    "@media (max-width:640px){.study-badge{left:12px;bottom:140px;font-size:11px}}"
+    ".study-badge-inline{margin-top:6px;font-size:12px;display:inline-block;padding:3px 8px;"
+    "border:1px solid #10a37f;border-radius:12px;color:#10a37f;background-color:#f6fffa}"
+    "</style>"
+)
+
 def render_study_mode_badge():
     if app_state.lesson_state.active and not app_state.lesson_state.completed and app_state.lesson_state.lesson_id:
         active_title = app_state.lessons_bank.get(app_state.lesson_state.lesson_id, {}).get("title", app_state.lesson_state.lesson_id)
+        step = app_state.lesson_state.current_step_idx + 1
+        # One element per rerun: Streamlit drops anything not re-emitted, so the CSS can't be sent only once
         st.markdown(
-            f"""
-            <style>
-                .study-badge {{
-                    position: fixed;
-                    left: 16px;
-                    bottom: 120px; /* larger offset ensures it clears the input on most setups */
-                    z-index: 9999999;
-                    background: #f0faf6;
-                    color: #0a7f5a;
-                    border: 1px solid #10a37f55;
-                    border-radius: 999px;
-                    padding: 3px 8px;
-                    font-size: 12px;
-                    font-weight: 500;
-                    box-shadow: 0 1px 3px rgba(0,0,0,0.08);
-                    pointer-events: none;
-                }}
-                @media (max-width: 640px) {{
-                    .study-badge {{
-                        left: 12px;
-                        bottom: 140px; /* a bit higher on small screens */
-                        font-size: 11px;
-                    }}
-                }}
-            </style>
-            <div class="study-badge">🟢 Study & Learn Mode — {active_title} (Step {app_state.lesson_state.current_step_idx+1})</div>
-            """,
-            unsafe_allow_html=True
-        )
-        # Inline fallback directly under the input (in case fixed overlay is blocked by theme/browser)
-        st.markdown(
-            f"""
-            <div style="
-                margin-top: 6px;
-                font-size: 12px;
-                display: inline-block;
-                padding: 3px 8px;
-                border: 1px solid #10a37f;
-                border-radius: 12px;
-                color: #10a37f;
-                background-color: #f6fffa;
-            ">
-                🟢 Study Mode Active — {active_title} (Step {app_state.lesson_state.current_step_idx+1})
-            </div>
-            """,
+            STUDY_BADGE_CSS
+            + f'<div class="study-badge">🟢 Study & Learn Mode — {active_title} (Step {step})</div>'
+            + f'<div class="study-badge-inline">🟢 Study Mode Active — {active_title} (Step {step})</div>',
             unsafe_allow_html=True
         )
 
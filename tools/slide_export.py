@@ -1,8 +1,10 @@
 # tools/slide_export.py
+import io
 import os
 import datetime
 from typing import List, Dict, Any
 from pptx import Presentation
+from pptx.dml.color import RGBColor
 from pptx.util import Inches, Pt
 from pptx.enum.text import PP_ALIGN
 
@@ -12,6 +14,23 @@ ACCENT_COLOR = "10A37F"     # green accent
 BODY_COLOR = "2E2E2E"       # neutral dark
 LIGHT_GREY = "777777"
 
+def _hex_to_rgb(hex_str: str) -> RGBColor:
+    hex_str = hex_str.lstrip("#")
+    return RGBColor(int(hex_str[0:2], 16), int(hex_str[2:4], 16), int(hex_str[4:6], 16))
+
+# Parsed once at import; every slide reuses these
+_TITLE_RGB = _hex_to_rgb(TITLE_COLOR)
+_ACCENT_RGB = _hex_to_rgb(ACCENT_COLOR)
+_BODY_RGB = _hex_to_rgb(BODY_COLOR)
+_GREY_RGB = _hex_to_rgb(LIGHT_GREY)
+
+_PT_14 = Pt(14)
+_PT_15 = Pt(15)
+_PT_16 = Pt(16)
+_PT_28 = Pt(28)
+_PT_32 = Pt(32)
+_PT_42 = Pt(42)
+
 def _add_title_slide(prs: Presentation, title: str, subtitle: str = ""):
     slide_layout = prs.slide_layouts[0]  # Title slide
     slide = prs.slides.add_slide(slide_layout)
@@ -19,14 +38,14 @@ def _add_title_slide(prs: Presentation, title: str, subtitle: str = ""):
     subtitle_tf = slide.placeholders[1]
 
     title_tf.text = title
-    title_tf.text_frame.paragraphs[0].font.size = Pt(42)
+    title_tf.text_frame.paragraphs[0].font.size = _PT_42
     title_tf.text_frame.paragraphs[0].font.bold = True
-    title_tf.text_frame.paragraphs[0].font.color.rgb = _hex_to_rgb(TITLE_COLOR)
+    title_tf.text_frame.paragraphs[0].font.color.rgb = _TITLE_RGB
 
     subtitle_tf.text = subtitle
     p = subtitle_tf.text_frame.paragraphs[0]
-    p.font.size = Pt(16)
-    p.font.color.rgb = _hex_to_rgb(LIGHT_GREY)
+    p.font.size = _PT_16
+    p.font.color.rgb = _GREY_RGB
     p.alignment = PP_ALIGN.LEFT
 
 def _add_section_title_slide(prs: Presentation, title: str, subtitle: str = ""):
@@ -34,9 +53,9 @@ def _add_section_title_slide(prs: Presentation, title: str, subtitle: str = ""):
     slide = prs.slides.add_slide(slide_layout)
     title_tf = slide.shapes.title
     title_tf.text = title
-    title_tf.text_frame.paragraphs[0].font.size = Pt(32)
+    title_tf.text_frame.paragraphs[0].font.size = _PT_32
     title_tf.text_frame.paragraphs[0].font.bold = True
-    title_tf.text_frame.paragraphs[0].font.color.rgb = _hex_to_rgb(TITLE_COLOR)
+    title_tf.text_frame.paragraphs[0].font.color.rgb = _TITLE_RGB
 
     if subtitle:
         txbox = slide.shapes.add_textbox(Inches(1), Inches(1.6), Inches(8), Inches(1))
@@ -44,8 +63,8 @@ def _add_section_title_slide(prs: Presentation, title: str, subtitle: str = ""):
         tf.word_wrap = True
         p = tf.paragraphs[0]
         p.text = subtitle
-        p.font.size = Pt(16)
-        p.font.color.rgb = _hex_to_rgb(LIGHT_GREY)
+        p.font.size = _PT_16
+        p.font.color.rgb = _GREY_RGB
 
 def _add_bullets_slide(prs: Presentation, title: str, bullets: List[str]):
     slide_layout = prs.slide_layouts[1]  # Title and Content
@@ -54,9 +73,9 @@ def _add_bullets_slide(prs: Presentation, title: str, bullets: List[str]):
     body_tf = slide.placeholders[1]
 
     title_tf.text = title
-    title_tf.text_frame.paragraphs[0].font.size = Pt(28)
+    title_tf.text_frame.paragraphs[0].font.size = _PT_28
     title_tf.text_frame.paragraphs[0].font.bold = True
-    title_tf.text_frame.paragraphs[0].font.color.rgb = _hex_to_rgb(TITLE_COLOR)
+    title_tf.text_frame.paragraphs[0].font.color.rgb = _TITLE_RGB
 
     tf = body_tf.text_frame
     tf.clear()
@@ -64,8 +83,8 @@ def _add_bullets_slide(prs: Presentation, title: str, bullets: List[str]):
         p = tf.add_paragraph() if i > 0 else tf.paragraphs[0]
         p.text = bullet
         p.level = 0
-        p.font.size = Pt(16)
-        p.font.color.rgb = _hex_to_rgb(BODY_COLOR)
+        p.font.size = _PT_16
+        p.font.color.rgb = _BODY_RGB
 
 def _add_step_slide(
     prs: Presentation,
@@ -79,9 +98,9 @@ def _add_step_slide(
     slide = prs.slides.add_slide(slide_layout)
     slide.shapes.title.text = step_title
     title_p = slide.shapes.title.text_frame.paragraphs[0]
-    title_p.font.size = Pt(28)
+    title_p.font.size = _PT_28
     title_p.font.bold = True
-    title_p.font.color.rgb = _hex_to_rgb(TITLE_COLOR)
+    title_p.font.color.rgb = _TITLE_RGB
 
     # Left column: user's input / outcome
     left = slide.shapes.add_textbox(Inches(0.75), Inches(1.6), Inches(4.3), Inches(4.5))
@@ -90,14 +109,14 @@ def _add_step_slide(
 
     p0 = tf_left.paragraphs[0]
     p0.text = "Your Input"
-    p0.font.size = Pt(16)
+    p0.font.size = _PT_16
     p0.font.bold = True
-    p0.font.color.rgb = _hex_to_rgb(ACCENT_COLOR)
+    p0.font.color.rgb = _ACCENT_RGB
 
     p1 = tf_left.add_paragraph()
     p1.text = user_input.strip() or "—"
-    p1.font.size = Pt(15)
-    p1.font.color.rgb = _hex_to_rgb(BODY_COLOR)
+    p1.font.size = _PT_15
+    p1.font.color.rgb = _BODY_RGB
 
     # Right column: goals + best practices
     right = slide.shapes.add_textbox(Inches(5.0), Inches(1.6), Inches(4.3), Inches(4.5))
@@ -106,60 +125,31 @@ def _add_step_slide(
 
     pr0 = tf_right.paragraphs[0]
     pr0.text = "Goals"
-    pr0.font.size = Pt(16)
+    pr0.font.size = _PT_16
     pr0.font.bold = True
-    pr0.font.color.rgb = _hex_to_rgb(ACCENT_COLOR)
-
-    if goals:
-        for g in goals:
-            pg = tf_right.add_paragraph()
-            pg.text = f"• {g}"
-            pg.font.size = Pt(14)
-            pg.font.color.rgb = _hex_to_rgb(BODY_COLOR)
-    else:
-        pg = tf_right.add_paragraph()
-        pg.text = "—"
-        pg.font.size = Pt(14)
-        pg.font.color.rgb = _hex_to_rgb(BODY_COLOR)
+    pr0.font.color.rgb = _ACCENT_RGB
+
+    _add_bullet_block(tf_right, goals)
 
     pr1 = tf_right.add_paragraph()
     pr1.text = ""  # spacer
 
     pr2 = tf_right.add_paragraph()
     pr2.text = "Best Practices"
-    pr2.font.size = Pt(16)
+    pr2.font.size = _PT_16
     pr2.font.bold = True
-    pr2.font.color.rgb = _hex_to_rgb(ACCENT_COLOR)
-
-    if best_practices:
-        for bp in best_practices:
-            pb = tf_right.add_paragraph()
-            pb.text = f"• {bp}"
-            pb.font.size = Pt(14)
-            pb.font.color.rgb = _hex_to_rgb(BODY_COLOR)
-    else:
-        pb = tf_right.add_paragraph()
-        pb.text = "—"
-        pb.font.size = Pt(14)
-        pb.font.color.rgb = _hex_to_rgb(BODY_COLOR)
-
-def _hex_to_rgb(hex_str: str):
-    from pptx.dml.color import RGBColor
-    hex_str = hex_str.lstrip("#")
-    return RGBColor(int(hex_str[0:2], 16), int(hex_str[2:4], 16), int(hex_str[4:6], 16))
+    pr2.font.color.rgb = _ACCENT_RGB
 
-def export_dmaic_to_pptx(steps_filled: List[Dict[str, Any]]) -> str:
-    """
-    Create a .pptx summarizing a DMAIC session.
+    _add_bullet_block(tf_right, best_practices)
 
-    steps_filled: list of dicts with keys:
-      - step: str (e.g., 'Define', 'Measure', ...)
-      - user_input: str
-      - goals: List[str]
-      - best_practices: List[str]
+def _add_bullet_block(tf, items: List[str]):
+    # One paragraph with line breaks instead of a styled paragraph per item
+    pb = tf.add_paragraph()
+    pb.text = "\n".join(f"• {item}" for item in items) if items else "—"
+    pb.font.size = _PT_14
+    pb.font.color.rgb = _BODY_RGB
 
-    Returns: file path to the generated pptx.
-    """
+def _build_dmaic_presentation(steps_filled: List[Dict[str, Any]]) -> Presentation:
     prs = Presentation()
 
     # Title slide
@@ -185,6 +175,31 @@ def export_dmaic_to_pptx(steps_filled: List[Dict[str, Any]]) -> str:
             goals=item.get("goals", []),
             best_practices=item.get("best_practices", []),
         )
+    return prs
+
+def export_dmaic_to_pptx_bytes(steps_filled: List[Dict[str, Any]]) -> bytes:
+    """
+    Same deck as export_dmaic_to_pptx, serialized in memory instead of written to disk.
+
+    Returns: the .pptx file contents.
+    """
+    buf = io.BytesIO()
+    _build_dmaic_presentation(steps_filled).save(buf)
+    return buf.getvalue()
+
+def export_dmaic_to_pptx(steps_filled: List[Dict[str, Any]]) -> str:
+    """
+    Create a .pptx summarizing a DMAIC session.
+
+    steps_filled: list of dicts with keys:
+      - step: str (e.g., 'Define', 'Measure', ...)
+      - user_input: str
+      - goals: List[str]
+      - best_practices: List[str]
+
+    Returns: file path to the generated pptx.
+    """
+    prs = _build_dmaic_presentation(steps_filled)
 
     # Save to disk (tmp folder by default)
     os.makedirs("exports", exist_ok=True)